@@ -2,22 +2,93 @@ import streamlit as st
 from PIL import Image
 import io
 import zipfile
-import tempfile
 import os
+import sys
+import functools
+import hashlib
+import itertools
+import collections
+import multiprocessing
 import pytesseract
 from pdf2image import convert_from_bytes
 from fpdf import FPDF
+from fpdf.enums import TextMode
 import cv2
 import numpy as np
 from PIL import ImageEnhance
+from concurrent.futures import Future, ProcessPoolExecutor
 
-def enhance_image(image):
-    """Enhance image for better OCR results."""
-    # Convert PIL Image to OpenCV format
-    img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+# OCR text is cached on disk keyed by a hash of the raw image bytes
+OCR_CACHE_DIR = os.environ.get(
+    "OCR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "zip_ocr")
+)
+
+# Integer "fast" LSTM models, much quicker than the default "best" ones
+TESSDATA_FAST_DIR = os.environ.get("TESSDATA_FAST_DIR", "/usr/share/tessdata_fast")
+
+# Unicode TrueType font for the hidden text layer
+TEXT_FONT_PATH = os.environ.get(
+    "TEXT_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
+def default_ocr_jobs():
+    """Read OCR_CONCURRENCY, falling back to the CPU count if unset or invalid."""
+    try:
+        return max(1, int(os.environ.get("OCR_CONCURRENCY", os.cpu_count() or 1)))
+    except ValueError:
+        return os.cpu_count() or 1
+
+# Number of pages OCR'd in parallel unless chosen in the UI
+DEFAULT_OCR_JOBS = default_ocr_jobs()
+
+# Part of the OCR cache key; bump it whenever is_blank_page changes so
+# pages cached as blank under an older rule are OCR'd again
+BLANK_PAGE_VERSION = 2
+
+@functools.lru_cache(maxsize=None)
+def cuda_available():
+    """Check whether OpenCV was built with CUDA and can see a GPU."""
+    # A CUDA build may leave out the cudaimgproc, cudafilters and
+    # cudaarithm modules enhance_image_cuda relies on
+    required = ("cvtColor", "createGaussianFilter", "subtract", "compare")
+    try:
+        if not all(hasattr(cv2.cuda, name) for name in required):
+            return False
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+def enhance_image_cuda(image):
+    """GPU version of enhance_image using OpenCV's CUDA module."""
+    src = cv2.cuda_GpuMat()
+    src.upload(np.asarray(image))
     
     # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cuda.cvtColor(src, cv2.COLOR_RGB2GRAY)
+    
+    # Adaptive Gaussian thresholding: a pixel turns white when it is
+    # brighter than its 11x11 Gaussian-weighted neighbourhood minus 2
+    gaussian = cv2.cuda.createGaussianFilter(
+        cv2.CV_8UC1, cv2.CV_8UC1, (11, 11), 0,
+        rowBorderMode=cv2.BORDER_REPLICATE
+    )
+    mean = gaussian.apply(gray)
+    
+    # Compare in a signed type: on CV_8U the offset would saturate, and
+    # white paper (gray == mean == 255) would come out black
+    gray16 = gray.convertTo(cv2.CV_16S)
+    mean16 = mean.convertTo(cv2.CV_16S)
+    offset = cv2.cuda_GpuMat(gray.size(), cv2.CV_16SC1, 2)
+    thresh = cv2.cuda.compare(gray16, cv2.cuda.subtract(mean16, offset), cv2.CMP_GT)
+    
+    # Download once and convert back to PIL Image
+    return Image.fromarray(thresh.download())
+
+def enhance_image_cpu(image):
+    """CPU version of enhance_image."""
+    # Convert to grayscale in one pass, without an intermediate BGR
+    # frame; asarray makes the one copy PIL's array interface requires
+    gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
     
     # Apply adaptive thresholding
     thresh = cv2.adaptiveThreshold(
@@ -28,85 +99,295 @@ def enhance_image(image):
     # Convert back to PIL Image
     return Image.fromarray(thresh)
 
-def process_image_with_ocr(image):
+def enhance_image(image):
+    """Enhance image for better OCR results."""
+    if cuda_available():
+        return enhance_image_cuda(image)
+    return enhance_image_cpu(image)
+
+def is_blank_page(image):
+    """Check whether a page has no marks that stand out from the paper."""
+    gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+    
+    # The most common gray level is the paper. Count the pixels that differ
+    # from it by more than scanner noise, in either direction so light text
+    # on dark paper counts too.
+    paper = int(np.argmax(np.bincount(gray.ravel(), minlength=256)))
+    marks = np.count_nonzero(cv2.absdiff(gray, paper) > 48)
+    
+    # A lone page number covers about 0.003% of an A4 scan
+    return marks / gray.size < 0.00001
+
+@functools.lru_cache(maxsize=None)
+def tesseract_api(fast_models=False):
+    """Return this process's Tesseract API handle, or None without tesserocr."""
+    # Imported lazily so it is only loaded inside the OCR workers, after
+    # their thread limits are in place
+    try:
+        import tesserocr
+    except ImportError:
+        return None
+    if fast_models:
+        return tesserocr.PyTessBaseAPI(path=TESSDATA_FAST_DIR, oem=tesserocr.OEM.LSTM_ONLY)
+    return tesserocr.PyTessBaseAPI()
+
+def process_image_with_ocr(image, max_side=2500, fast_models=False):
     """Process single image with OCR and return extracted text."""
+    # Downscale oversized scans; OCR time grows with the pixel count
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    
+    # Blank pages have no text; skip enhancement and the expensive
+    # Tesseract call for them
+    if is_blank_page(image):
+        return ""
+    
     # Enhance image for better OCR results
     enhanced_img = enhance_image(image)
     
-    # Extract text using Tesseract
+    # Extract text using Tesseract, through a persistent tesserocr handle
+    # when available instead of one tesseract process per page
+    api = tesseract_api(fast_models)
+    if api is not None:
+        api.SetImage(enhanced_img)
+        return api.GetUTF8Text()
+    
+    config = f'--oem 1 --tessdata-dir "{TESSDATA_FAST_DIR}"' if fast_models else ''
+    return pytesseract.image_to_string(enhanced_img, config=config)
+
+def ocr_backend(fast_models):
+    """Identify the preprocessing and OCR engine used by a worker process."""
+    return (
+        "cuda" if cuda_available() else "cpu",
+        "tesserocr" if tesseract_api(fast_models) is not None else "pytesseract",
+    )
+
+def ocr_cache_key(image_bytes, *settings):
+    """Return the OCR cache key for the raw bytes of an image."""
+    key = hashlib.blake2b(image_bytes, digest_size=16)
+    # OCR settings and the blank page rule change the extracted text, so
+    # they are part of the key
+    key.update(repr((BLANK_PAGE_VERSION,) + settings).encode())
+    return key.hexdigest()
+
+def load_cached_text(key):
+    """Return cached OCR text for key, or None on a cache miss."""
     try:
-        text = pytesseract.image_to_string(enhanced_img)
-        return text
+        with open(os.path.join(OCR_CACHE_DIR, f"{key}.txt"), encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def save_cached_text(key, text):
+    """Store OCR text for key; a failing cache never fails the OCR."""
+    path = os.path.join(OCR_CACHE_DIR, f"{key}.txt")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def _init_ocr_worker(threads_per_page=1):
+    """Cap the threads each OCR worker uses; the pool already spans the cores."""
+    # Inherited by the tesseract processes pytesseract starts, and read by
+    # tesserocr's OpenMP runtime, which is only loaded after this point
+    os.environ["OMP_THREAD_LIMIT"] = str(threads_per_page)
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_page)
+    cv2.setNumThreads(threads_per_page)
+
+class ImageDecodeError(Exception):
+    """An image passed Image.verify() but its pixel data is broken."""
+
+def _ocr_one(image_bytes, cache_key, max_side, fast_models):
+    """Decode and OCR a single image; runs inside a worker process."""
+    # verify() in the main process never decodes the pixels, so corrupt
+    # image data only shows up here
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
     except Exception as e:
-        st.warning(f"OCR failed: {str(e)}")
-        return ""
+        raise ImageDecodeError(str(e)) from e
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    text = process_image_with_ocr(img, max_side, fast_models)
+    save_cached_text(cache_key, text)
+    return text
+
+def iter_image_entries(zip_ref, image_names):
+    """Yield (file name, raw bytes) for each readable image in the archive."""
+    for name in image_names:
+        file = os.path.basename(name)
+        try:
+            with zip_ref.open(name) as fh:
+                image_bytes = fh.read()
+            # Check the file without decoding it; the PDF embeds the
+            # original bytes and the OCR worker decodes its own copy
+            Image.open(io.BytesIO(image_bytes)).verify()
+        except Exception as e:
+            st.warning(f"Skipped {file}: {str(e)}")
+            continue
+        yield file, image_bytes
+
+def submit_ocr(executor, image_bytes, max_side, fast_models, backend, seen):
+    """Queue OCR for one image and return a Future holding its text."""
+    cache_key = ocr_cache_key(image_bytes, max_side, fast_models, backend)
+    
+    # Duplicate scans in this ZIP share the OCR of their first copy
+    if cache_key in seen:
+        return seen[cache_key]
+    
+    # Skip OCR entirely for images seen in earlier runs
+    cached_text = load_cached_text(cache_key)
+    if cached_text is not None:
+        future = Future()
+        future.set_result(cached_text)
+    else:
+        future = executor.submit(_ocr_one, image_bytes, cache_key, max_side, fast_models)
+    seen[cache_key] = future
+    return future
+
+def iter_ocr_pages(executor, entries, total, max_side, fast_models, backend, max_pending):
+    """Yield (image bytes, text) pages in order while later pages are OCR'd.
+    
+    At most max_pending raw pages are read ahead of the PDF writer, and
+    decoded pixels only exist inside the workers, one page each.
+    """
+    entries = iter(entries)
+    pending = collections.deque()
+    seen = {}
+    progress = st.progress(0.0)
+    
+    def read_ahead(count):
+        for file, image_bytes in itertools.islice(entries, count):
+            future = submit_ocr(
+                executor, image_bytes, max_side, fast_models, backend, seen
+            )
+            pending.append((file, image_bytes, future))
+    
+    read_ahead(max_pending)
+    done = 0
+    while pending:
+        file, image_bytes, future = pending.popleft()
+        # Keep the workers busy while this page is waited on and written
+        read_ahead(1)
+        try:
+            text = future.result()
+            st.success(f"Processed {file}")
+        except ImageDecodeError as e:
+            # The PDF cannot embed it either, so leave the page out
+            st.warning(f"Skipped {file}: {str(e)}")
+            continue
+        except Exception as e:
+            st.warning(f"OCR failed for {file}: {str(e)}")
+            text = ""
+        done += 1
+        progress.progress(min(done / total, 1.0))
+        yield image_bytes, text
+    
+    # Skipped entries never count as done, so finish the bar explicitly
+    progress.progress(1.0)
 
-def create_searchable_pdf(images, texts):
-    """Create a searchable PDF with images and OCR text."""
+def create_searchable_pdf(pages):
+    """Create a searchable PDF from (image bytes, OCR text) pages."""
     pdf = FPDF()
-    for image, text in zip(images, texts):
-        # Add image
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-            image.save(tmp, 'JPEG')
-            tmp_path = tmp.name
-        
-        # Add new page and image
+    
+    # Text layer style is the same on every page and add_page() carries
+    # it over, so set it once. A Unicode font keeps non-Latin OCR text,
+    # and rendering mode 3 (invisible) makes it searchable but not drawn.
+    # Without the font file, fall back to a Latin-1 core font.
+    unicode_font = os.path.isfile(TEXT_FONT_PATH)
+    if unicode_font:
+        pdf.add_font("DejaVu", fname=TEXT_FONT_PATH)
+        pdf.set_font("DejaVu", size=1)  # Tiny font size for invisible text
+    else:
+        pdf.set_font("Helvetica", size=1)
+    pdf.text_mode = TextMode.INVISIBLE
+    
+    for image_bytes, text in pages:
+        # Add new page and embed the original image bytes as-is (JPEGs are
+        # passed through as DCT streams, nothing is re-encoded)
         pdf.add_page()
-        pdf.image(tmp_path, x=10, y=10, w=190)
+        pdf.image(io.BytesIO(image_bytes), x=10, y=10, w=190)
         
         # Add invisible text layer
-        pdf.set_font("Arial", size=1)  # Tiny font size for invisible text
-        pdf.set_text_color(255, 255, 255)  # White color (invisible)
+        if not unicode_font:
+            text = text.encode('latin-1', 'replace').decode('latin-1')
         pdf.multi_cell(0, 1, text)
-        
-        # Clean up temporary file
-        os.unlink(tmp_path)
     
-    # Save PDF to memory
-    pdf_buffer = io.BytesIO()
-    pdf.output(pdf_buffer)
-    return pdf_buffer.getvalue()
+    # Serialise the PDF; fpdf2 returns the document buffer directly, so
+    # no intermediate BytesIO copy is needed
+    return bytes(pdf.output())
 
-def process_zip_to_searchable_pdf(zip_file):
+def process_zip_to_searchable_pdf(zip_file, max_side=2500, max_workers=DEFAULT_OCR_JOBS,
+                                  fast_models=False, threads_per_page=1):
     """Convert images from zip file to searchable PDF with OCR."""
     try:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Extract zip contents
-            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            
-            # Get all image files
-            images = []
-            texts = []
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            # Get all image files, read straight from the archive. macOS
+            # resource forks (__MACOSX/, ._name.jpg) share the image
+            # extensions but are not images, so skip them up front.
             valid_extensions = {'.jpg', '.jpeg', '.png'}
+            image_names = sorted(
+                info.filename for info in zip_ref.infolist()
+                if not info.is_dir()
+                and os.path.splitext(info.filename)[1].lower() in valid_extensions
+                and not info.filename.startswith('__MACOSX/')
+                and not os.path.basename(info.filename).startswith('._')
+            )
             
-            # Process each image
-            for root, _, files in os.walk(temp_dir):
-                for file in sorted(files):
-                    if any(file.lower().endswith(ext) for ext in valid_extensions):
-                        image_path = os.path.join(root, file)
-                        try:
-                            # Open and process image
-                            img = Image.open(image_path)
-                            if img.mode != 'RGB':
-                                img = img.convert('RGB')
-                            
-                            # Extract text using OCR
-                            text = process_image_with_ocr(img)
-                            
-                            images.append(img)
-                            texts.append(text)
-                            
-                            st.success(f"Processed {file}")
-                        except Exception as e:
-                            st.warning(f"Skipped {file}: {str(e)}")
+            if not os.path.isfile(TEXT_FONT_PATH):
+                st.warning(
+                    f"Font {TEXT_FONT_PATH} not found; characters outside "
+                    "Latin-1 will be replaced in the PDF text layer"
+                )
             
-            if not images:
-                st.error("No valid images found in the ZIP file")
-                return None
+            # Forked workers share the already imported OpenCV/NumPy pages
+            # copy-on-write instead of re-importing them; pinned because
+            # Python 3.14 no longer defaults to fork. Only on Linux:
+            # forking is unsafe with macOS system frameworks.
+            if sys.platform.startswith("linux"):
+                mp_context = multiprocessing.get_context("fork")
+            else:
+                mp_context = None
             
-            # Create searchable PDF
-            return create_searchable_pdf(images, texts)
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=mp_context,
+                initializer=_init_ocr_worker,
+                initargs=(threads_per_page,)
+            ) as executor:
+                # The OCR text depends on the workers' backend too, so ask
+                # one of them (the parent never touches CUDA before forking)
+                backend = executor.submit(ocr_backend, fast_models).result()
+                
+                # Pipeline: read images while earlier pages are being OCR'd
+                # (max_workers Tesseract processes) and write PDF pages as
+                # soon as their text is ready
+                pages = iter_ocr_pages(
+                    executor,
+                    iter_image_entries(zip_ref, image_names),
+                    total=len(image_names),
+                    max_side=max_side,
+                    fast_models=fast_models,
+                    backend=backend,
+                    max_pending=2 * max_workers
+                )
+                
+                try:
+                    first_page = next(pages, None)
+                    if first_page is None:
+                        st.error("No valid images found in the ZIP file")
+                        return None
+                    
+                    # Create searchable PDF
+                    return create_searchable_pdf(itertools.chain([first_page], pages))
+                except Exception:
+                    # Don't make the error wait for the queued pages' OCR
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
             
     except Exception as e:
         st.error(f"Error processing ZIP file: {str(e)}")
@@ -132,9 +413,45 @@ def main():
             value="Balanced"
         )
         
+        max_side = st.slider(
+            "Max OCR image size (px)",
+            min_value=1000,
+            max_value=5000,
+            value=2500,
+            step=100,
+            help="Larger scans are downscaled to this long edge before OCR"
+        )
+        
+        ocr_jobs = st.number_input(
+            "Parallel OCR jobs",
+            min_value=1,
+            max_value=max(os.cpu_count() or 1, DEFAULT_OCR_JOBS),
+            value=DEFAULT_OCR_JOBS,
+            help="Number of pages processed at the same time"
+        )
+        
+        threads_per_page = st.number_input(
+            "Threads per page",
+            min_value=1,
+            max_value=4,
+            value=1,
+            help="Tesseract/OpenCV threads per page; for a few long pages, "
+                 "fewer parallel jobs with more threads each can be faster"
+        )
+        
+        fast_models = st.checkbox(
+            "Fast models",
+            value=False,
+            disabled=not os.path.isdir(TESSDATA_FAST_DIR),
+            help=f"Use the faster, slightly less accurate Tesseract models in {TESSDATA_FAST_DIR}"
+        )
+        
         if st.button("Convert to Searchable PDF"):
             with st.spinner("Converting images and performing OCR..."):
-                pdf_bytes = process_zip_to_searchable_pdf(uploaded_file)
+                pdf_bytes = process_zip_to_searchable_pdf(
+                    uploaded_file, max_side, int(ocr_jobs), fast_models,
+                    int(threads_per_page)
+                )
                 
                 if pdf_bytes:
                     st.success("Conversion completed!")
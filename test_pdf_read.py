@@ -0,0 +1,103 @@
+import io
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pdf_read = pytest.importorskip("pdf_read")
+from PIL import Image
+
+
+def make_page():
+    """White page with one line of black text."""
+    page = np.full((400, 600, 3), 255, dtype=np.uint8)
+    cv2.putText(page, "Searchable PDF", (40, 200), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 4)
+    return Image.fromarray(page)
+
+
+def make_sparse_page():
+    """A4 page at 300 dpi with one short line of text."""
+    page = np.full((3508, 2480, 3), 255, dtype=np.uint8)
+    cv2.putText(page, "Page 2 of 10", (1000, 3300), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 2)
+    return Image.fromarray(page)
+
+
+def make_noisy_blank_page():
+    """Blank A4 scan: sensor noise around a light gray, saved as JPEG."""
+    rng = np.random.default_rng(0)
+    page = np.clip(rng.normal(235, 3, (3508, 2480, 3)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(page).save(buf, format="JPEG")
+    return Image.open(buf).convert("RGB")
+
+
+def png_bytes(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def corrupt_png():
+    """PNG whose IDAT data is garbage but carries a valid CRC."""
+    data = bytearray(png_bytes(make_page()))
+    start = data.index(b"IDAT")
+    length = int.from_bytes(data[start - 4:start], "big")
+    data[start + 14:start + 4 + length] = bytes(length - 10)
+    crc = zlib.crc32(data[start:start + 4 + length])
+    data[start + 4 + length:start + 8 + length] = crc.to_bytes(4, "big")
+    return bytes(data)
+
+
+@pytest.mark.skipif(not pdf_read.cuda_available(), reason="OpenCV has no CUDA device")
+def test_cuda_threshold_matches_cpu():
+    image = make_page()
+    gpu = np.asarray(pdf_read.enhance_image_cuda(image))
+    cpu = np.asarray(pdf_read.enhance_image_cpu(image))
+    
+    assert gpu.shape == cpu.shape
+    # Gaussian rounding may differ on a few edge pixels, nothing more
+    assert np.mean(gpu != cpu) < 0.01
+    # The paper must stay white
+    assert np.mean(gpu == 0) < 0.1
+
+
+def test_cuda_needs_image_modules(monkeypatch):
+    # CUDA core with a device, but built without cudaarithm
+    cuda = types.SimpleNamespace(
+        getCudaEnabledDeviceCount=lambda: 1,
+        cvtColor=None,
+        createGaussianFilter=None,
+    )
+    monkeypatch.setattr(pdf_read.cv2, "cuda", cuda)
+    pdf_read.cuda_available.cache_clear()
+    try:
+        assert not pdf_read.cuda_available()
+        cuda.subtract = cuda.compare = None
+        pdf_read.cuda_available.cache_clear()
+        assert pdf_read.cuda_available()
+    finally:
+        pdf_read.cuda_available.cache_clear()
+
+
+def test_undecodable_image_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_read, "OCR_CACHE_DIR", str(tmp_path))
+    bad = corrupt_png()
+    Image.open(io.BytesIO(bad)).verify()  # only fails once decoded
+    blank = png_bytes(Image.new("RGB", (600, 400), "white"))
+    
+    with ThreadPoolExecutor(2) as executor:
+        pages = list(pdf_read.iter_ocr_pages(
+            executor, [("bad.png", bad), ("blank.png", blank)], total=2,
+            max_side=2500, fast_models=False, backend=("cpu", "test"),
+            max_pending=2
+        ))
+    
+    assert pages == [(blank, "")]
+
+
+def test_blank_page_detection():
+    assert not pdf_read.is_blank_page(make_sparse_page())
+    assert pdf_read.is_blank_page(make_noisy_blank_page())